@@ -4,7 +4,8 @@ Personal Finance Manager - CLI
 Project ID: UY6758GH
 
 Features:
- - User registration & authentication (unique username + password hash)
+ - User registration & authentication (unique username + password hash;
+   Argon2id when argon2-cffi is installed, PBKDF2-SHA256 otherwise)
  - Add / update / delete income & expense entries, categorized
  - Monthly / yearly financial reports (totals & savings)
  - Budgets per-category + notify on exceed
@@ -15,95 +16,372 @@ Features:
 import sqlite3
 import os
 import sys
-from datetime import datetime, date
+import threading
+import weakref
+import calendar
+from datetime import datetime, date, timezone
 import getpass
 import hashlib
 import secrets
-import shutil
+from collections import OrderedDict
 import argparse
 from typing import Optional, Tuple, List
 
+try:
+    from argon2 import PasswordHasher
+    from argon2.exceptions import InvalidHashError, VerificationError
+except ImportError:  # optional; PBKDF2 is used when argon2-cffi is missing
+    PasswordHasher = None
+
 DB_FILENAME = "pfm.db"
 SALT_BYTES = 16
 PBKDF2_ITERS = 150_000
+PBKDF2_HASH = "sha256"
+ARGON2_TIME_COST = 2
+ARGON2_MEMORY_COST = 65536  # KiB
+ARGON2_PARALLELISM = 1
+ARGON2_PREFIX = b"$argon2"
+LOGIN_CACHE_SIZE = 64
+
+# transactions.type is stored as a small integer
+TX_INCOME = 0
+TX_EXPENSE = 1
+TX_TYPE_NAMES = ("income", "expense")  # indexed by the stored code
+
+SQLITE_PRAGMAS = (
+    "journal_mode=WAL",
+    "synchronous=NORMAL",
+    "temp_store=MEMORY",
+    "cache_size=-64000",
+    "mmap_size=268435456",
+    "foreign_keys=ON",
+    "busy_timeout=5000",
+)
+SQLITE_CACHED_STATEMENTS = 256
+BACKUP_PAGES = 1024
+
+# ---------- Hot-path SQL ----------
+# Kept as module constants so every call site passes the identical string and
+# hits the connection's prepared-statement cache.
+
+SQL_INSERT_TX = """
+    INSERT INTO transactions (user_id, type, amount, category_id, note, occurred_at, created_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+"""
+
+# Returns the id of the new or already existing category in one statement
+# (the no-op DO UPDATE is what makes RETURNING fire on conflict).
+SQL_UPSERT_CATEGORY = """
+    INSERT INTO categories (user_id, name) VALUES (?, ?)
+    ON CONFLICT(user_id, name) DO UPDATE SET name = excluded.name
+    RETURNING id
+"""
+
+SQL_SUM_BY_TYPE_RANGE = """
+    SELECT type, SUM(amount) as total FROM transactions
+    WHERE user_id = ? AND occurred_at >= ? AND occurred_at < ?
+    GROUP BY type
+"""
+
+# Monthly report in one pass: the CTE scans the date range once and feeds both
+# the per-type totals ('TOTAL' rows) and the expense breakdown ('CAT' rows).
+SQL_REPORT_MONTH = """
+    WITH tx AS MATERIALIZED (
+        SELECT type, amount, category_id FROM transactions
+        WHERE user_id = ? AND occurred_at >= ? AND occurred_at < ?
+    )
+    SELECT 'TOTAL' as kind, type, NULL as name, SUM(amount) as total
+    FROM tx
+    GROUP BY type
+    UNION ALL
+    SELECT 'CAT', 1, c.name, SUM(tx.amount)
+    FROM tx
+    LEFT JOIN categories c ON tx.category_id = c.id
+    WHERE tx.type = 1 -- TX_EXPENSE
+    GROUP BY c.name
+    ORDER BY kind, total DESC
+"""
+
+SQL_SELECT_BUDGET = """
+    SELECT amount FROM budgets WHERE user_id = ? AND category_id = ? AND month = ? AND year = ?
+"""
+
+SQL_SUM_EXPENSES_MONTH = """
+    SELECT SUM(amount) as total FROM transactions
+    WHERE user_id = ? AND category_id = ? AND type = 1 AND occurred_at >= ? AND occurred_at < ? -- TX_EXPENSE
+"""
+
+# ---------- Schema ----------
+# Whole schema as one script so init_db bootstraps it in a single call and a
+# single transaction. PRAGMA user_version records which SCHEMA_VERSION a file
+# is at; _migrate_schema upgrades older files.
+#   0: original layout, transactions timestamps as ISO-8601 TEXT
+#   1: transactions.occurred_at / created_at as INTEGER unix seconds (UTC)
+#   2: transactions.type as INTEGER TX_INCOME / TX_EXPENSE codes
+SCHEMA_VERSION = 2
+
+# Column list of the transactions table, shared by SCHEMA_DDL and the
+# table rebuild in _migrate_schema.
+TRANSACTIONS_TABLE_DDL = """(
+    id INTEGER PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    type INTEGER NOT NULL CHECK(type IN (0, 1)), -- TX_INCOME / TX_EXPENSE
+    amount REAL NOT NULL CHECK(amount >= 0),
+    category_id INTEGER,
+    note TEXT,
+    occurred_at INTEGER NOT NULL, -- unix seconds, UTC
+    created_at INTEGER NOT NULL,
+    FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE,
+    FOREIGN KEY(category_id) REFERENCES categories(id) ON DELETE SET NULL
+)"""
+
+SCHEMA_DDL = f"""
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY,
+    username TEXT UNIQUE NOT NULL,
+    password_hash BLOB NOT NULL,
+    salt BLOB NOT NULL,
+    created_at TEXT NOT NULL
+);
+
+-- Categories - user-specific categories are allowed but start with defaults
+CREATE TABLE IF NOT EXISTS categories (
+    id INTEGER PRIMARY KEY,
+    user_id INTEGER,
+    name TEXT NOT NULL,
+    UNIQUE(user_id, name),
+    FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE
+);
+
+CREATE TABLE IF NOT EXISTS transactions {TRANSACTIONS_TABLE_DDL};
+
+-- Budgets (monthly budgets per category)
+CREATE TABLE IF NOT EXISTS budgets (
+    id INTEGER PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    category_id INTEGER NOT NULL,
+    amount REAL NOT NULL CHECK(amount >= 0),
+    month INTEGER NOT NULL, -- 1..12
+    year INTEGER NOT NULL,
+    UNIQUE(user_id, category_id, month, year),
+    FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE,
+    FOREIGN KEY(category_id) REFERENCES categories(id) ON DELETE CASCADE
+);
+
+-- Indexes for the per-user date-range filters used by listings, reports
+-- and budget checks (budgets lookups are covered by their UNIQUE index)
+CREATE INDEX IF NOT EXISTS idx_tx_user_occurred
+ON transactions(user_id, occurred_at DESC);
+
+CREATE INDEX IF NOT EXISTS idx_tx_user_cat_type_occurred
+ON transactions(user_id, category_id, type, occurred_at);
+
+PRAGMA user_version = {SCHEMA_VERSION};
+
+COMMIT;
+"""
 
 # ---------- Database helpers ----------
 
+# Each thread keeps one open connection per database path, reused by every
+# helper so SQLite's page cache survives between calls. With WAL, readers on
+# other threads never block the writer; writes open with BEGIN IMMEDIATE so
+# concurrent writers queue on busy_timeout instead of failing to upgrade.
+_tls = threading.local()
+
+class _ThreadConns:
+    # Holder for one thread's connections. threading.local drops it when the
+    # thread exits, and the finalizer then closes them; still-live holders
+    # are finalized at interpreter exit.
+    def __init__(self):
+        self.conns = {}
+        weakref.finalize(self, _close_conns, self.conns)
+
+def _close_conns(conns: dict):
+    for conn in conns.values():
+        conn.close()
+    conns.clear()
+
+def _thread_conns() -> dict:
+    holder = getattr(_tls, "holder", None)
+    if holder is None:
+        holder = _tls.holder = _ThreadConns()
+    return holder.conns
+
 def get_conn(db_path: str = DB_FILENAME) -> sqlite3.Connection:
-    conn = sqlite3.connect(db_path)
-    conn.row_factory = sqlite3.Row
+    conns = _thread_conns()
+    conn = conns.get(db_path)
+    if conn is None:
+        conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level="IMMEDIATE",
+                               cached_statements=SQLITE_CACHED_STATEMENTS)
+        conn.row_factory = sqlite3.Row
+        for pragma in SQLITE_PRAGMAS:
+            conn.execute(f"PRAGMA {pragma}")
+        conns[db_path] = conn
     return conn
 
+def close_conn(db_path: Optional[str] = None):
+    """Close this thread's connection for db_path (or all of them if None)."""
+    conns = _thread_conns()
+    paths = list(conns) if db_path is None else [db_path]
+    for path in paths:
+        conn = conns.pop(path, None)
+        if conn is not None:
+            conn.close()
+    # cached budget state describes the database that was just closed
+    _clear_budget_cache()
+
+def _legacy_to_epoch(value):
+    # ISO-8601 text from schema version 0; digit strings are epochs that newer
+    # code wrote into a still-TEXT column
+    if value is None or isinstance(value, int):
+        return value
+    if value.isdigit():
+        return int(value)
+    occurred = datetime.fromisoformat(value)
+    if occurred.tzinfo is not None:
+        occurred = occurred.astimezone(timezone.utc).replace(tzinfo=None)
+    return _to_epoch(occurred)
+
+def _migrate_schema(conn: sqlite3.Connection):
+    """Bring the database on conn up to SCHEMA_VERSION (no-op when current)."""
+    if conn.execute("PRAGMA user_version").fetchone()[0] >= SCHEMA_VERSION:
+        return
+    declared = {r["name"]: r["type"].upper() for r in conn.execute("PRAGMA table_info(transactions)")}
+    exprs = {col: col for col in declared}
+    for col in ("occurred_at", "created_at"):
+        if declared.get(col) == "TEXT":
+            exprs[col] = f"_legacy_to_epoch({col})"
+    if declared.get("type") == "TEXT":
+        # unknown values stay as they are and fail the new CHECK constraint
+        exprs["type"] = "CASE type WHEN 'income' THEN 0 WHEN 'expense' THEN 1 ELSE type END"
+    if any(col != expr for col, expr in exprs.items()):
+        # SQLite can't retype a column in place: copy into a table with the
+        # current layout, converting on the way, then swap it in
+        conn.create_function("_legacy_to_epoch", 1, _legacy_to_epoch, deterministic=True)
+        try:
+            conn.executescript(f"""
+                BEGIN IMMEDIATE;
+                CREATE TABLE transactions_new {TRANSACTIONS_TABLE_DDL};
+                INSERT INTO transactions_new ({", ".join(exprs)})
+                SELECT {", ".join(exprs.values())} FROM transactions;
+                DROP TABLE transactions;
+                ALTER TABLE transactions_new RENAME TO transactions;
+                COMMIT;
+            """)
+        except Exception:
+            conn.rollback()
+            raise
+    # creates whatever is missing (including the indexes dropped with the old
+    # table) and stamps user_version
+    conn.executescript(SCHEMA_DDL)
+
 def init_db(db_path: str = DB_FILENAME):
     create = not os.path.exists(db_path)
     conn = get_conn(db_path)
-    cur = conn.cursor()
-    # Users
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY,
-            username TEXT UNIQUE NOT NULL,
-            password_hash BLOB NOT NULL,
-            salt BLOB NOT NULL,
-            created_at TEXT NOT NULL
-        );
-    """)
-    # Categories - user-specific categories are allowed but start with defaults
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS categories (
-            id INTEGER PRIMARY KEY,
-            user_id INTEGER,
-            name TEXT NOT NULL,
-            UNIQUE(user_id, name),
-            FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE
-        );
-    """)
-    # Transactions
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS transactions (
-            id INTEGER PRIMARY KEY,
-            user_id INTEGER NOT NULL,
-            type TEXT NOT NULL CHECK(type IN ('income','expense')),
-            amount REAL NOT NULL CHECK(amount >= 0),
-            category_id INTEGER,
-            note TEXT,
-            occurred_at TEXT NOT NULL,
-            created_at TEXT NOT NULL,
-            FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE,
-            FOREIGN KEY(category_id) REFERENCES categories(id) ON DELETE SET NULL
-        );
-    """)
-    # Budgets (monthly budgets per category)
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS budgets (
-            id INTEGER PRIMARY KEY,
-            user_id INTEGER NOT NULL,
-            category_id INTEGER NOT NULL,
-            amount REAL NOT NULL CHECK(amount >= 0),
-            month INTEGER NOT NULL, -- 1..12
-            year INTEGER NOT NULL,
-            UNIQUE(user_id, category_id, month, year),
-            FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE,
-            FOREIGN KEY(category_id) REFERENCES categories(id) ON DELETE CASCADE
-        );
-    """)
-    conn.commit()
+    _migrate_schema(conn)
     if create:
         print(f"[init] Database created at {db_path}")
-    conn.close()
+    # release so the file is checkpointed and safe to copy
+    close_conn(db_path)
+
+# ---------- Time helpers ----------
+# Transaction timestamps are stored as integer unix seconds (UTC) so range
+# filters compare integers and the indexes stay small.
+
+def _to_epoch(value) -> int:
+    # naive dates/datetimes are UTC, like everything else in the app
+    if isinstance(value, datetime) and value.tzinfo is not None:
+        return calendar.timegm(value.utctimetuple())
+    return calendar.timegm(value.timetuple())
+
+def _from_epoch(ts: int) -> datetime:
+    return datetime.fromtimestamp(ts, timezone.utc).replace(tzinfo=None)
+
+def _month_bounds(month: int, year: int) -> Tuple[int, int]:
+    # [start, end) of the month as epoch seconds; December rolls into next year
+    return _to_epoch(date(year, month, 1)), _to_epoch(date(year + month // 12, month % 12 + 1, 1))
 
 # ---------- Security helpers ----------
 
+_PH = (PasswordHasher(time_cost=ARGON2_TIME_COST, memory_cost=ARGON2_MEMORY_COST,
+                      parallelism=ARGON2_PARALLELISM)
+       if PasswordHasher is not None else None)
+
 def hash_password(password: str, salt: Optional[bytes] = None) -> Tuple[bytes, bytes]:
+    # New hashes are Argon2id when available; the encoded hash embeds its own
+    # salt, so the salt column is left empty. Passing a salt always means
+    # PBKDF2 (used to verify rows created before Argon2 was enabled).
+    if salt is None and _PH is not None:
+        return _PH.hash(password).encode('ascii'), b""
     if salt is None:
         salt = secrets.token_bytes(SALT_BYTES)
-    pw_hash = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt, PBKDF2_ITERS)
+    # hashlib.pbkdf2_hmac is OpenSSL's PKCS5_PBKDF2_HMAC: it runs the whole
+    # iteration loop in C (SHA-NI accelerated where the CPU has it) with the
+    # GIL released, so there is nothing to gain from another binding.
+    pw_hash = hashlib.pbkdf2_hmac(PBKDF2_HASH, password.encode('utf-8'), salt, PBKDF2_ITERS)
     return pw_hash, salt
 
 def verify_password(stored_hash: bytes, stored_salt: bytes, password_attempt: str) -> bool:
+    stored_hash = bytes(stored_hash)
+    if stored_hash.startswith(ARGON2_PREFIX):
+        if _PH is None:
+            raise RuntimeError("argon2-cffi is required to verify this password")
+        try:
+            return _PH.verify(stored_hash.decode('ascii'), password_attempt)
+        except (VerificationError, InvalidHashError):
+            return False
     attempt_hash, _ = hash_password(password_attempt, stored_salt)
     return secrets.compare_digest(stored_hash, attempt_hash)
 
+def needs_rehash(stored_hash: bytes) -> bool:
+    # PBKDF2 rows (or Argon2 rows with outdated parameters) once Argon2 is on
+    if _PH is None:
+        return False
+    stored_hash = bytes(stored_hash)
+    if not stored_hash.startswith(ARGON2_PREFIX):
+        return True
+    return _PH.check_needs_rehash(stored_hash.decode('ascii'))
+
+# (username, sha256(password)) -> (user_id, password_hash) for credentials
+# already verified in this process. Only a digest of the password is kept; an
+# entry is honoured only while the user's row still has the same id and hash.
+# Shared by all threads, so every access holds _login_cache_lock.
+_LOGIN_CACHE = OrderedDict()
+_login_cache_lock = threading.Lock()
+
+def _login_cache_key(username: str, password: str) -> Tuple[str, bytes]:
+    return username, hashlib.sha256(password.encode('utf-8')).digest()
+
+def _remember_login(username: str, password: str, user_id: int, pw_hash: bytes):
+    key = _login_cache_key(username, password)
+    with _login_cache_lock:
+        _LOGIN_CACHE[key] = (user_id, bytes(pw_hash))
+        _LOGIN_CACHE.move_to_end(key)
+        if len(_LOGIN_CACHE) > LOGIN_CACHE_SIZE:
+            _LOGIN_CACHE.popitem(last=False)
+
+def _verify_login(username: str, row: sqlite3.Row, password: str) -> bool:
+    key = _login_cache_key(username, password)
+    with _login_cache_lock:
+        cached = _LOGIN_CACHE.get(key)
+        if cached is not None and cached[0] == row["id"] and secrets.compare_digest(cached[1], row["password_hash"]):
+            _LOGIN_CACHE.move_to_end(key)
+            return True
+    if not verify_password(row["password_hash"], row["salt"], password):
+        return False
+    pw_hash = row["password_hash"]
+    if needs_rehash(pw_hash):
+        # migrate the stored hash now that we hold the verified password
+        pw_hash, salt = hash_password(password)
+        conn = get_conn()
+        with conn:
+            conn.execute("UPDATE users SET password_hash = ?, salt = ? WHERE id = ?", (pw_hash, salt, row["id"]))
+    _remember_login(username, password, int(row["id"]), pw_hash)
+    return True
+
 # ---------- User Management ----------
 
 def register(username: str, password: str) -> bool:
@@ -112,32 +390,31 @@ def register(username: str, password: str) -> bool:
     created_at = datetime.utcnow().isoformat()
     pw_hash, salt = hash_password(password)
     try:
-        cur.execute("INSERT INTO users (username, password_hash, salt, created_at) VALUES (?, ?, ?, ?)",
-                    (username, pw_hash, salt, created_at))
-        user_id = cur.lastrowid
-        # Insert default categories for the new user
-        defaults = ["Salary", "Food", "Rent", "Transport", "Entertainment", "Utilities", "Other"]
-        for name in defaults:
-            cur.execute("INSERT INTO categories (user_id, name) VALUES (?, ?)", (user_id, name))
-        conn.commit()
+        # user + default categories commit (or roll back) as one transaction
+        with conn:
+            cur.execute("INSERT INTO users (username, password_hash, salt, created_at) VALUES (?, ?, ?, ?)",
+                        (username, pw_hash, salt, created_at))
+            user_id = cur.lastrowid
+            # Insert default categories for the new user
+            defaults = ["Salary", "Food", "Rent", "Transport", "Entertainment", "Utilities", "Other"]
+            cur.executemany("INSERT INTO categories (user_id, name) VALUES (?, ?)",
+                            [(user_id, name) for name in defaults])
+        _remember_login(username, password, user_id, pw_hash)
         print(f"[ok] User '{username}' registered.")
         return True
     except sqlite3.IntegrityError:
         print("[error] Username already exists.")
         return False
-    finally:
-        conn.close()
 
 def login(username: str, password: str) -> Optional[int]:
     conn = get_conn()
     cur = conn.cursor()
     cur.execute("SELECT id, password_hash, salt FROM users WHERE username = ?", (username,))
     row = cur.fetchone()
-    conn.close()
     if row is None:
         print("[error] No such user.")
         return None
-    if verify_password(row["password_hash"], row["salt"], password):
+    if _verify_login(username, row, password):
         print(f"[ok] Logged in as {username}")
         return int(row["id"])
     else:
@@ -148,52 +425,87 @@ def login(username: str, password: str) -> Optional[int]:
 
 def add_category(user_id: int, name: str) -> int:
     conn = get_conn()
-    cur = conn.cursor()
-    try:
-        cur.execute("INSERT INTO categories (user_id, name) VALUES (?, ?)", (user_id, name))
-        conn.commit()
-        return cur.lastrowid
-    except sqlite3.IntegrityError:
-        # fetch existing
-        cur.execute("SELECT id FROM categories WHERE user_id = ? AND name = ?", (user_id, name))
-        row = cur.fetchone()
-        return int(row["id"])
-    finally:
-        conn.close()
+    with conn:
+        row = conn.execute(SQL_UPSERT_CATEGORY, (user_id, name)).fetchone()
+    return int(row["id"])
 
 def list_categories(user_id: int) -> List[sqlite3.Row]:
     conn = get_conn()
     cur = conn.cursor()
     cur.execute("SELECT id, name FROM categories WHERE user_id = ? ORDER BY name", (user_id,))
     rows = cur.fetchall()
-    conn.close()
     return rows
 
 # ---------- Transactions ----------
 
-def add_transaction(user_id: int, tx_type: str, amount: float, category: Optional[str], note: Optional[str], occurred_at: Optional[str]) -> int:
-    if tx_type not in ("income", "expense"):
-        raise ValueError("tx_type must be 'income' or 'expense'")
+def _tx_type_code(tx_type) -> int:
+    # accepts 'income'/'expense' or the stored TX_INCOME/TX_EXPENSE code
+    if tx_type in (TX_INCOME, TX_EXPENSE) and not isinstance(tx_type, bool):
+        return int(tx_type)
+    if tx_type in TX_TYPE_NAMES:
+        return TX_TYPE_NAMES.index(tx_type)
+    raise ValueError("tx_type must be 'income' or 'expense'")
+
+def add_transaction(user_id: int, tx_type, amount: float, category: Optional[str], note: Optional[str], occurred_at: Optional[str]) -> int:
+    tx_type = _tx_type_code(tx_type)
+    now = datetime.utcnow()
+    now_ts = _to_epoch(now)
     if occurred_at is None:
-        occurred_at = datetime.utcnow().isoformat()
+        occurred, occurred_ts = now, now_ts
+    else:
+        occurred = datetime.fromisoformat(occurred_at)
+        if occurred.tzinfo is not None:
+            occurred = occurred.astimezone(timezone.utc).replace(tzinfo=None)
+        occurred_ts = _to_epoch(occurred)
     conn = get_conn()
-    cur = conn.cursor()
-    category_id = None
-    if category:
-        # ensure category exists (create if needed)
-        category_id = add_category(user_id, category)
-    cur.execute("""
-        INSERT INTO transactions (user_id, type, amount, category_id, note, occurred_at, created_at)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
-    """, (user_id, tx_type, float(amount), category_id, note, occurred_at, datetime.utcnow().isoformat()))
-    conn.commit()
-    tx_id = cur.lastrowid
-    conn.close()
-    # After adding an expense, check budgets
-    if tx_type == "expense" and category_id is not None:
-        check_budget_notify(user_id, category_id, occurred_at)
+    key = None
+    try:
+        with conn:
+            cur = conn.cursor()
+            category_id = None
+            if category:
+                # ensure category exists (create if needed); upserted here rather
+                # than via add_category so it commits or rolls back with the insert
+                category_id = int(conn.execute(SQL_UPSERT_CATEGORY, (user_id, category)).fetchone()["id"])
+            cur.execute(SQL_INSERT_TX, (user_id, tx_type, float(amount), category_id, note, occurred_ts, now_ts))
+            tx_id = cur.lastrowid
+            # After adding an expense, check budgets on the same (still open)
+            # transaction so the insert and the budget SUM share one commit
+            if tx_type == TX_EXPENSE and category_id is not None:
+                key = (user_id, category_id, occurred.year, occurred.month)
+                with _budget_cache_lock:
+                    if key in _month_totals:
+                        _month_totals[key] += float(amount)
+                check_budget_notify(user_id, category_id, occurred.month, occurred.year)
+    except Exception:
+        # the insert was rolled back; a total bumped or seeded with it is stale
+        if key is not None:
+            with _budget_cache_lock:
+                _month_totals.pop(key, None)
+        raise
     return tx_id
 
+def add_transactions_bulk(user_id: int, rows: List[dict]) -> int:
+    # rows: dicts with 'type', 'amount' and optional 'category', 'note', 'occurred_at'.
+    # Inserted in one transaction; budget alerts are not raised for bulk imports.
+    # validate and convert every row before touching the database, so a bad
+    # row can't leave anything (not even new categories) behind
+    now = _to_epoch(datetime.utcnow())
+    parsed = [(_tx_type_code(r["type"]), float(r["amount"]), r.get("category") or None, r.get("note"),
+               _to_epoch(datetime.fromisoformat(r["occurred_at"])) if r.get("occurred_at") else now)
+              for r in rows]
+    conn = get_conn()
+    with conn:
+        # categories are upserted inside the import transaction (add_category
+        # would commit each one on its own)
+        cats = {name: int(conn.execute(SQL_UPSERT_CATEGORY, (user_id, name)).fetchone()["id"])
+                for name in {p[2] for p in parsed} if name}
+        params = [(user_id, code, amount, cats.get(cat), note, occurred, now)
+                  for code, amount, cat, note, occurred in parsed]
+        conn.executemany(SQL_INSERT_TX, params)
+    _clear_budget_cache(user_id)
+    return len(params)
+
 def update_transaction(user_id: int, tx_id: int, **kwargs) -> bool:
     allowed = {"type", "amount", "category", "note", "occurred_at"}
     updates = {}
@@ -202,42 +514,39 @@ def update_transaction(user_id: int, tx_id: int, **kwargs) -> bool:
             updates[k] = v
     if not updates:
         return False
+    if "type" in updates:
+        updates["type"] = _tx_type_code(updates["type"])
+    if "occurred_at" in updates:
+        updates["occurred_at"] = _to_epoch(datetime.fromisoformat(updates["occurred_at"]))
     conn = get_conn()
-    cur = conn.cursor()
-    # fetch transaction and verify ownership
-    cur.execute("SELECT id FROM transactions WHERE id = ? AND user_id = ?", (tx_id, user_id))
-    if cur.fetchone() is None:
-        conn.close()
-        return False
-    # handle category specially
-    if "category" in updates:
-        cat_name = updates.pop("category")
-        if cat_name is None:
-            category_id = None
-        else:
-            category_id = add_category(user_id, cat_name)
-        updates["category_id"] = category_id
-    set_clause = ", ".join([f"{k} = ?" for k in updates.keys()])
-    params = list(updates.values()) + [tx_id]
-    cur.execute(f"UPDATE transactions SET {set_clause} WHERE id = ?", params)
-    conn.commit()
-    conn.close()
+    with conn:
+        # fetch transaction and verify ownership
+        if conn.execute("SELECT id FROM transactions WHERE id = ? AND user_id = ?", (tx_id, user_id)).fetchone() is None:
+            return False
+        # handle category specially; upserted in the same transaction as the update
+        if "category" in updates:
+            cat_name = updates.pop("category")
+            updates["category_id"] = int(conn.execute(SQL_UPSERT_CATEGORY, (user_id, cat_name)).fetchone()["id"])
+        set_clause = ", ".join([f"{k} = ?" for k in updates.keys()])
+        params = list(updates.values()) + [tx_id]
+        conn.execute(f"UPDATE transactions SET {set_clause} WHERE id = ?", params)
+    _clear_budget_cache(user_id)
     return True
 
 def delete_transaction(user_id: int, tx_id: int) -> bool:
     conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("DELETE FROM transactions WHERE id = ? AND user_id = ?", (tx_id, user_id))
-    changed = cur.rowcount
-    conn.commit()
-    conn.close()
+    with conn:
+        changed = conn.execute("DELETE FROM transactions WHERE id = ? AND user_id = ?", (tx_id, user_id)).rowcount
+    if changed:
+        _clear_budget_cache(user_id)
     return changed > 0
 
 def list_transactions(user_id: int, limit: int = 50) -> List[sqlite3.Row]:
     conn = get_conn()
     cur = conn.cursor()
     cur.execute("""
-        SELECT t.id, t.type, t.amount, c.name as category, t.note, t.occurred_at
+        SELECT t.id, CASE t.type WHEN 0 THEN 'income' WHEN 1 THEN 'expense' END as type,
+               t.amount, c.name as category, t.note, t.occurred_at
         FROM transactions t
         LEFT JOIN categories c ON t.category_id = c.id
         WHERE t.user_id = ?
@@ -245,57 +554,72 @@ def list_transactions(user_id: int, limit: int = 50) -> List[sqlite3.Row]:
         LIMIT ?
     """, (user_id, limit))
     rows = cur.fetchall()
-    conn.close()
     return rows
 
 # ---------- Budgeting ----------
 
+# Budget-check caches keyed by (user_id, category_id, year, month). A month's
+# expense total is seeded by one SUM and then bumped by add_transaction, so
+# repeated checks don't rescan the month. Any other write for the user drops
+# that user's entries. Shared by all threads, so every access holds
+# _budget_cache_lock (never across a query).
+_month_totals = {}
+_month_budgets = {}
+_budget_cache_lock = threading.Lock()
+
+def _clear_budget_cache(user_id: Optional[int] = None):
+    with _budget_cache_lock:
+        for cache in (_month_totals, _month_budgets):
+            if user_id is None:
+                cache.clear()
+            else:
+                for key in [k for k in cache if k[0] == user_id]:
+                    del cache[key]
+
 def set_budget(user_id: int, category: str, amount: float, month: int, year: int) -> bool:
-    # ensure category exists
     conn = get_conn()
-    cur = conn.cursor()
-    cat_id = add_category(user_id, category)
-    try:
-        cur.execute("""
+    with conn:
+        # ensure category exists, in the same transaction as the budget row
+        cat_id = int(conn.execute(SQL_UPSERT_CATEGORY, (user_id, category)).fetchone()["id"])
+        conn.execute("""
             INSERT INTO budgets (user_id, category_id, amount, month, year)
             VALUES (?, ?, ?, ?, ?)
             ON CONFLICT(user_id, category_id, month, year) DO UPDATE SET amount = excluded.amount
         """, (user_id, cat_id, amount, month, year))
-        conn.commit()
-        return True
-    finally:
-        conn.close()
+    with _budget_cache_lock:
+        _month_budgets.pop((user_id, cat_id, year, month), None)
+    return True
 
 def get_budget(user_id: int, category_id: int, month: int, year: int) -> Optional[float]:
     conn = get_conn()
     cur = conn.cursor()
-    cur.execute("SELECT amount FROM budgets WHERE user_id = ? AND category_id = ? AND month = ? AND year = ?",
-                (user_id, category_id, month, year))
+    cur.execute(SQL_SELECT_BUDGET, (user_id, category_id, month, year))
     row = cur.fetchone()
-    conn.close()
     return float(row["amount"]) if row else None
 
-def check_budget_notify(user_id: int, category_id: int, occurred_at_iso: str):
-    occurred = datetime.fromisoformat(occurred_at_iso)
-    month, year = occurred.month, occurred.year
-    budget_amount = get_budget(user_id, category_id, month, year)
+def check_budget_notify(user_id: int, category_id: int, month: int, year: int):
+    key = (user_id, category_id, year, month)
+    with _budget_cache_lock:
+        have_budget = key in _month_budgets
+        budget_amount = _month_budgets.get(key)
+    if not have_budget:
+        budget_amount = get_budget(user_id, category_id, month, year)
+        with _budget_cache_lock:
+            _month_budgets[key] = budget_amount
     if budget_amount is None:
         return
-    # compute total expenses for category in month
-    conn = get_conn()
-    cur = conn.cursor()
-    start = date(year, month, 1).isoformat()
-    if month == 12:
-        end = date(year + 1, 1, 1).isoformat()
-    else:
-        end = date(year, month + 1, 1).isoformat()
-    cur.execute("""
-        SELECT SUM(amount) as total FROM transactions
-        WHERE user_id = ? AND category_id = ? AND type = 'expense' AND occurred_at >= ? AND occurred_at < ?
-    """, (user_id, category_id, start, end))
-    row = cur.fetchone()
-    conn.close()
-    total = float(row["total"]) if row["total"] is not None else 0.0
+    with _budget_cache_lock:
+        total = _month_totals.get(key)
+    if total is None:
+        # compute total expenses for category in month
+        conn = get_conn()
+        cur = conn.cursor()
+        start, end = _month_bounds(month, year)
+        cur.execute(SQL_SUM_EXPENSES_MONTH, (user_id, category_id, start, end))
+        row = cur.fetchone()
+        total = float(row["total"]) if row["total"] is not None else 0.0
+        with _budget_cache_lock:
+            _month_totals[key] = total
     if total > budget_amount:
         print(f"[budget alert] You have exceeded your budget for this category this month: {total:.2f} > {budget_amount:.2f}")
 
@@ -304,50 +628,30 @@ def check_budget_notify(user_id: int, category_id: int, occurred_at_iso: str):
 def report_monthly(user_id: int, month: int, year: int) -> dict:
     conn = get_conn()
     cur = conn.cursor()
-    start = date(year, month, 1).isoformat()
-    if month == 12:
-        end = date(year + 1, 1, 1).isoformat()
-    else:
-        end = date(year, month + 1, 1).isoformat()
-    cur.execute("""
-        SELECT type, SUM(amount) as total FROM transactions
-        WHERE user_id = ? AND occurred_at >= ? AND occurred_at < ?
-        GROUP BY type
-    """, (user_id, start, end))
-    rows = cur.fetchall()
+    start, end = _month_bounds(month, year)
+    cur.execute(SQL_REPORT_MONTH, (user_id, start, end))
     totals = {"income": 0.0, "expense": 0.0}
-    for r in rows:
-        totals[r["type"]] = float(r["total"])
-    # breakdown by category (expenses)
-    cur.execute("""
-        SELECT c.name, SUM(t.amount) as total
-        FROM transactions t
-        LEFT JOIN categories c ON t.category_id = c.id
-        WHERE t.user_id = ? AND t.type = 'expense' AND t.occurred_at >= ? AND t.occurred_at < ?
-        GROUP BY c.name
-        ORDER BY total DESC
-    """, (user_id, start, end))
-    breakdown = [(r["name"] or "Uncategorized", float(r["total"])) for r in cur.fetchall()]
-    conn.close()
+    breakdown = []
+    for r in cur.fetchall():
+        if r["kind"] == "TOTAL":
+            totals[TX_TYPE_NAMES[r["type"]]] = float(r["total"])
+        else:
+            # breakdown by category (expenses), already sorted by total
+            breakdown.append((r["name"] or "Uncategorized", float(r["total"])))
     totals["savings"] = totals["income"] - totals["expense"]
     return {"period": f"{year}-{month:02d}", "totals": totals, "expense_by_category": breakdown}
 
 def report_yearly(user_id: int, year: int) -> dict:
     conn = get_conn()
     cur = conn.cursor()
-    start = date(year, 1, 1).isoformat()
-    end = date(year + 1, 1, 1).isoformat()
-    cur.execute("""
-        SELECT type, SUM(amount) as total FROM transactions
-        WHERE user_id = ? AND occurred_at >= ? AND occurred_at < ?
-        GROUP BY type
-    """, (user_id, start, end))
+    start = _to_epoch(date(year, 1, 1))
+    end = _to_epoch(date(year + 1, 1, 1))
+    cur.execute(SQL_SUM_BY_TYPE_RANGE, (user_id, start, end))
     rows = cur.fetchall()
     totals = {"income": 0.0, "expense": 0.0}
     for r in rows:
-        totals[r["type"]] = float(r["total"])
+        totals[TX_TYPE_NAMES[r["type"]]] = float(r["total"])
     totals["savings"] = totals["income"] - totals["expense"]
-    conn.close()
     return {"period": str(year), "totals": totals}
 
 # ---------- Backup & Restore ----------
@@ -355,13 +659,28 @@ def report_yearly(user_id: int, year: int) -> dict:
 def backup_db(backup_path: str):
     if not os.path.exists(DB_FILENAME):
         raise FileNotFoundError("Database file not found.")
-    shutil.copy2(DB_FILENAME, backup_path)
+    # online backup: copies pages through SQLite (WAL contents included)
+    # without closing or blocking the live connection
+    dst = sqlite3.connect(backup_path)
+    try:
+        get_conn().backup(dst, pages=BACKUP_PAGES)
+    finally:
+        dst.close()
     print(f"[ok] Backup written to {backup_path}")
 
 def restore_db(backup_path: str):
     if not os.path.exists(backup_path):
         raise FileNotFoundError("Backup file not found.")
-    shutil.copy2(backup_path, DB_FILENAME)
+    # reopen (recreating the file if it is gone) and drop state cached for the
+    # old contents, then copy the backup's pages into the live database
+    close_conn(DB_FILENAME)
+    src = sqlite3.connect(backup_path)
+    try:
+        src.backup(get_conn(), pages=BACKUP_PAGES)
+    finally:
+        src.close()
+    # backups from older versions (or an empty file) need the current schema
+    _migrate_schema(get_conn())
     print(f"[ok] Database restored from {backup_path}")
 
 # ---------- CLI ----------
@@ -451,9 +770,10 @@ def run_cli():
             elif choice == "6":
                 if not require_login(): continue
                 rows = list_transactions(current_user_id, limit=50)
-                print("Recent transactions:")
-                for r in rows:
-                    print(f" id={r['id']:>3} | {r['type']:7} | {r['amount']:8.2f} | {r['category'] or 'Uncat':12} | {r['occurred_at'][:10]} | {r['note'] or ''}")
+                lines = ["Recent transactions:"]
+                lines += [f" id={r['id']:>3} | {r['type']:7} | {r['amount']:8.2f} | {r['category'] or 'Uncat':12} | {_from_epoch(r['occurred_at']).date().isoformat()} | {r['note'] or ''}"
+                          for r in rows]
+                sys.stdout.write("\n".join(lines) + "\n")
             elif choice == "7":
                 if not require_login(): continue
                 cat = input("Category: ").strip()
@@ -471,9 +791,9 @@ def run_cli():
                 print(f"  Income:  {rpt['totals']['income']:.2f}")
                 print(f"  Expense: {rpt['totals']['expense']:.2f}")
                 print(f"  Savings: {rpt['totals']['savings']:.2f}")
-                print("  Expenses by category:")
-                for name, tot in rpt["expense_by_category"]:
-                    print(f"    {name or 'Uncategorized'}: {tot:.2f}")
+                lines = ["  Expenses by category:"]
+                lines += [f"    {name or 'Uncategorized'}: {tot:.2f}" for name, tot in rpt["expense_by_category"]]
+                sys.stdout.write("\n".join(lines) + "\n")
             elif choice == "9":
                 if not require_login(): continue
                 year = int(input("Year (e.g. 2025): ").strip())
@@ -490,8 +810,6 @@ def run_cli():
                 confirm = input("This will overwrite current DB. Continue? (yes/no): ").strip().lower()
                 if confirm == "yes":
                     restore_db(path)
-                    # Re-init to ensure schema intact
-                    init_db()
             elif choice == "12":
                 if not require_login(): continue
                 cats = list_categories(current_user_id)
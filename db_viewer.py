@@ -1,26 +1,21 @@
 import sqlite3
 
+BATCH_SIZE = 1024
+
 conn = sqlite3.connect("pfm.db")
+# read-only inspection; let SQLite mmap the file instead of read()ing pages
+conn.execute("PRAGMA query_only=1;")
+conn.execute("PRAGMA mmap_size=268435456;")
 cursor = conn.cursor()
+cursor.arraysize = BATCH_SIZE
 
-print("\n=== Users ===")
-cursor.execute("SELECT * FROM users;")
-for row in cursor.fetchall():
-    print(row)
-
-print("\n=== Categories ===")
-cursor.execute("SELECT * FROM categories;")
-for row in cursor.fetchall():
-    print(row)
-
-print("\n=== Transactions ===")
-cursor.execute("SELECT * FROM transactions;")
-for row in cursor.fetchall():
-    print(row)
-
-print("\n=== Budgets ===")
-cursor.execute("SELECT * FROM budgets;")
-for row in cursor.fetchall():
-    print(row)
+for title, table in (("Users", "users"), ("Categories", "categories"),
+                     ("Transactions", "transactions"), ("Budgets", "budgets")):
+    print(f"\n=== {title} ===")
+    cursor.execute(f"SELECT * FROM {table};")
+    # stream in batches so large tables never sit in memory all at once
+    while (rows := cursor.fetchmany()):
+        for row in rows:
+            print(row)
 
 conn.close()
@@ -1,8 +1,14 @@
 import unittest
+import sqlite3
 import os
 import tempfile
 import shutil
-from app import init_db, get_conn, register, login, add_transaction, list_transactions, set_budget, report_monthly, backup_db, restore_db, DB_FILENAME
+import io
+import threading
+from contextlib import redirect_stdout
+from unittest import mock
+import app
+from app import init_db, get_conn, close_conn, register, login, add_transaction, add_transactions_bulk, list_categories, update_transaction, delete_transaction, list_transactions, set_budget, report_monthly, backup_db, restore_db, DB_FILENAME, TX_EXPENSE
 
 class TestPFM(unittest.TestCase):
     def setUp(self):
@@ -18,6 +24,7 @@ class TestPFM(unittest.TestCase):
         shutil.copy2(self.db_path, DB_FILENAME)
 
     def tearDown(self):
+        close_conn()
         try:
             os.remove(DB_FILENAME)
         except Exception:
@@ -30,6 +37,28 @@ class TestPFM(unittest.TestCase):
         uid = login("testuser", "pass123")
         self.assertIsNotNone(uid)
 
+    @unittest.skipUnless(app._PH is not None, "argon2-cffi not installed")
+    def test_argon2_upgrades_pbkdf2_rows(self):
+        register("legacy", "pw")
+        legacy_hash, salt = app.hash_password("pw", app.secrets.token_bytes(app.SALT_BYTES))
+        conn = get_conn()
+        with conn:
+            conn.execute("UPDATE users SET password_hash = ?, salt = ? WHERE username = ?",
+                         (legacy_hash, salt, "legacy"))
+        self.assertIsNotNone(login("legacy", "pw"))
+        row = conn.execute("SELECT password_hash FROM users WHERE username = ?", ("legacy",)).fetchone()
+        self.assertTrue(bytes(row["password_hash"]).startswith(app.ARGON2_PREFIX))
+        self.assertIsNone(login("legacy", "wrong"))
+
+    def test_login_cache(self):
+        register("cuser", "secret")
+        # credentials verified at registration skip the KDF on login
+        with mock.patch("app.verify_password") as verify:
+            self.assertIsNotNone(login("cuser", "secret"))
+            verify.assert_not_called()
+        # a wrong password is never served from the cache
+        self.assertIsNone(login("cuser", "wrong"))
+
     def test_transactions_and_reports(self):
         register("t2", "p")
         uid = login("t2", "p")
@@ -45,6 +74,60 @@ class TestPFM(unittest.TestCase):
         self.assertAlmostEqual(rpt["totals"]["expense"], 500.0)
         self.assertAlmostEqual(rpt["totals"]["savings"], 500.0)
 
+    def test_bulk_import(self):
+        register("bulk", "p")
+        uid = login("bulk", "p")
+        n = add_transactions_bulk(uid, [
+            {"type": "income", "amount": 1000.0, "category": "Salary"},
+            {"type": "expense", "amount": "40.5", "category": "Books", "note": "new category"},
+            {"type": "expense", "amount": 9.5, "occurred_at": "2024-02-10T00:00:00"},
+        ])
+        self.assertEqual(n, 3)
+        self.assertEqual(len(list_transactions(uid)), 3)
+        today = __import__("datetime").datetime.utcnow()
+        rpt = report_monthly(uid, today.month, today.year)
+        self.assertAlmostEqual(rpt["totals"]["income"], 1000.0)
+        self.assertEqual(rpt["expense_by_category"], [("Books", 40.5)])
+        rpt = report_monthly(uid, 2, 2024)
+        self.assertEqual(rpt["expense_by_category"], [("Uncategorized", 9.5)])
+        with self.assertRaises(ValueError):
+            add_transactions_bulk(uid, [{"type": "refund", "amount": 1.0}])
+
+    def test_transaction_type_codes(self):
+        register("codes", "p")
+        uid = login("codes", "p")
+        tx_id = add_transaction(uid, TX_EXPENSE, 25.0, "Food", None, None)
+        self.assertEqual(list_transactions(uid)[0]["type"], "expense")
+        self.assertTrue(update_transaction(uid, tx_id, type="income"))
+        self.assertEqual(list_transactions(uid)[0]["type"], "income")
+        with self.assertRaises(ValueError):
+            add_transaction(uid, "refund", 1.0, None, None, None)
+
+    def test_bulk_import_is_atomic(self):
+        register("bulk2", "p")
+        uid = login("bulk2", "p")
+        before = [c["name"] for c in list_categories(uid)]
+        with self.assertRaises(ValueError):
+            add_transactions_bulk(uid, [
+                {"type": "expense", "amount": 5.0, "category": "Gadgets"},
+                {"type": "expense", "amount": "lots", "category": "Gadgets"},
+            ])
+        with self.assertRaises(sqlite3.IntegrityError):
+            add_transactions_bulk(uid, [
+                {"type": "expense", "amount": 5.0, "category": "Gadgets"},
+                {"type": "expense", "amount": -1.0, "category": "Gadgets"},
+            ])
+        self.assertEqual([c["name"] for c in list_categories(uid)], before)
+        self.assertEqual(len(list_transactions(uid)), 0)
+
+    def test_report_month_boundaries(self):
+        register("edge", "p")
+        uid = login("edge", "p")
+        add_transaction(uid, "expense", 1.0, "Food", None, "2024-12-31T23:59:59")
+        add_transaction(uid, "expense", 2.0, "Food", None, "2025-01-01T00:00:00")
+        self.assertAlmostEqual(report_monthly(uid, 12, 2024)["totals"]["expense"], 1.0)
+        self.assertAlmostEqual(report_monthly(uid, 1, 2025)["totals"]["expense"], 2.0)
+
     def test_budget_notification(self):
         register("t3", "p")
         uid = login("t3", "p")
@@ -57,6 +140,200 @@ class TestPFM(unittest.TestCase):
         add_transaction(uid, "expense", 120.0, "Food", "big meal", today.isoformat())
         # nothing to assert here except no exceptions
 
+    def test_budget_running_total(self):
+        register("t4", "p")
+        uid = login("t4", "p")
+        today = __import__("datetime").datetime.utcnow()
+        set_budget(uid, "Food", 100.0, today.month, today.year)
+
+        def alerts(amount):
+            out = io.StringIO()
+            with redirect_stdout(out):
+                tx_id = add_transaction(uid, "expense", amount, "Food", None, None)
+            return tx_id, "[budget alert]" in out.getvalue()
+
+        self.assertFalse(alerts(60.0)[1])
+        tx_id, alerted = alerts(50.0)  # 110 > 100 from the cached running total
+        self.assertTrue(alerted)
+        # deleting drops the cached total, so the next check sees 60 + 30
+        self.assertTrue(delete_transaction(uid, tx_id))
+        self.assertFalse(alerts(30.0)[1])
+        set_budget(uid, "Food", 80.0, today.month, today.year)
+        self.assertTrue(alerts(1.0)[1])
+
+    def test_thread_local_connections(self):
+        register("th", "p")
+        uid = login("th", "p")
+        add_transaction(uid, "income", 10.0, "Salary", None, None)
+        seen = {}
+
+        def reader():
+            seen["conn"] = get_conn()
+            seen["rows"] = len(list_transactions(uid))
+            close_conn()
+
+        worker = threading.Thread(target=reader)
+        worker.start()
+        worker.join()
+        self.assertIsNot(seen["conn"], get_conn())
+        self.assertEqual(seen["rows"], 1)
+
+    def test_budget_total_survives_rollback(self):
+        register("t5", "p")
+        uid = login("t5", "p")
+        today = __import__("datetime").datetime.utcnow()
+        set_budget(uid, "Food", 100.0, today.month, today.year)
+        add_transaction(uid, "expense", 60.0, "Food", None, None)  # seeds the cached total
+        with mock.patch("app.check_budget_notify", side_effect=RuntimeError("boom")):
+            with self.assertRaises(RuntimeError):
+                add_transaction(uid, "expense", 50.0, "Food", None, None)
+        self.assertEqual(len(list_transactions(uid)), 1)
+        out = io.StringIO()
+        with redirect_stdout(out):
+            add_transaction(uid, "expense", 30.0, "Food", None, None)  # 90, not 140
+        self.assertNotIn("[budget alert]", out.getvalue())
+
+    def test_failed_writes_roll_back(self):
+        register("rb", "p")
+        uid = login("rb", "p")
+        tx = add_transaction(uid, "expense", 5.0, None, None, None)
+        conn = get_conn()
+        with self.assertRaises(sqlite3.IntegrityError):
+            set_budget(uid, "Gym", -5.0, 1, 2025)
+        self.assertFalse(conn.in_transaction)
+        self.assertNotIn("Gym", [r["name"] for r in list_categories(uid)])
+        with self.assertRaises(sqlite3.IntegrityError):
+            update_transaction(uid, tx, amount=-3.0)
+        self.assertFalse(conn.in_transaction)
+        self.assertEqual(list_transactions(uid)[0]["amount"], 5.0)
+
+    def test_failed_transaction_leaves_no_category(self):
+        register("oc", "p")
+        uid = login("oc", "p")
+        with self.assertRaises(sqlite3.IntegrityError):
+            add_transaction(uid, "expense", -1.0, "Orphan", None, None)
+        tx = add_transaction(uid, "expense", 5.0, None, None, None)
+        with self.assertRaises(sqlite3.IntegrityError):
+            update_transaction(uid, tx, category="Orphan", amount=-3.0)
+        self.assertNotIn("Orphan", [r["name"] for r in list_categories(uid)])
+        self.assertIsNone(list_transactions(uid)[0]["category"])
+
+    def test_failed_write_does_not_block_other_threads(self):
+        register("lk", "p")
+        uid = login("lk", "p")
+        failed, done = threading.Event(), threading.Event()
+        errors = []
+
+        def bad_budget():
+            # the thread (and its connection) outlives the failure
+            try:
+                set_budget(uid, "Food", -5.0, 1, 2025)
+            except sqlite3.IntegrityError:
+                pass
+            except Exception as exc:
+                errors.append(exc)
+            failed.set()
+            done.wait(10)
+
+        worker = threading.Thread(target=bad_budget)
+        worker.start()
+        try:
+            self.assertTrue(failed.wait(10))
+            self.assertIsNotNone(add_transaction(uid, "expense", 5.0, "Food", None, None))
+        finally:
+            done.set()
+            worker.join()
+        self.assertEqual(errors, [])
+
+    def _write_legacy_db(self, path):
+        # schema and data as written by the original (version 0) app
+        pw_hash, salt = app.hash_password("p", b"0" * app.SALT_BYTES)
+        conn = sqlite3.connect(path)
+        conn.executescript("""
+            CREATE TABLE users (id INTEGER PRIMARY KEY, username TEXT UNIQUE NOT NULL,
+                password_hash BLOB NOT NULL, salt BLOB NOT NULL, created_at TEXT NOT NULL);
+            CREATE TABLE categories (id INTEGER PRIMARY KEY, user_id INTEGER, name TEXT NOT NULL,
+                UNIQUE(user_id, name), FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE);
+            CREATE TABLE transactions (id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL,
+                type TEXT NOT NULL CHECK(type IN ('income','expense')),
+                amount REAL NOT NULL CHECK(amount >= 0), category_id INTEGER, note TEXT,
+                occurred_at TEXT NOT NULL, created_at TEXT NOT NULL,
+                FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE,
+                FOREIGN KEY(category_id) REFERENCES categories(id) ON DELETE SET NULL);
+            CREATE TABLE budgets (id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL,
+                category_id INTEGER NOT NULL, amount REAL NOT NULL CHECK(amount >= 0),
+                month INTEGER NOT NULL, year INTEGER NOT NULL, UNIQUE(user_id, category_id, month, year));
+            INSERT INTO categories VALUES (1, 1, 'Salary'), (2, 1, 'Rent');
+            INSERT INTO transactions VALUES
+                (1, 1, 'income', 1000.0, 1, NULL, '2025-09-19T00:00:00', '2025-09-10T14:36:40.383355'),
+                (2, 1, 'expense', 300.0, 2, NULL, '2025-09-10T14:56:59.192801', '2025-09-10T14:56:59.271061');
+        """)
+        conn.execute("INSERT INTO users VALUES (1, 'old', ?, ?, '2025-09-10T14:14:39')", (pw_hash, salt))
+        conn.commit()
+        conn.close()
+
+    def _assert_legacy_migrated(self):
+        uid = login("old", "p")
+        rpt = report_monthly(uid, 9, 2025)
+        self.assertAlmostEqual(rpt["totals"]["income"], 1000.0)
+        self.assertEqual(rpt["expense_by_category"], [("Rent", 300.0)])
+        self.assertEqual([r["type"] for r in list_transactions(uid)], ["income", "expense"])
+        add_transaction(uid, "expense", 5.0, "Rent", None, "2025-09-20")
+        self.assertAlmostEqual(report_monthly(uid, 9, 2025)["totals"]["expense"], 305.0)
+
+    def test_init_db_migrates_legacy_database(self):
+        close_conn()
+        os.remove(DB_FILENAME)
+        self._write_legacy_db(DB_FILENAME)
+        init_db(DB_FILENAME)
+        self._assert_legacy_migrated()
+
+    def test_restore_migrates_legacy_backup(self):
+        legacy = os.path.join(self.tmpdir, "legacy.db")
+        self._write_legacy_db(legacy)
+        restore_db(legacy)
+        self._assert_legacy_migrated()
+
+    def test_thread_connections_closed_on_exit(self):
+        register("th2", "p")
+        uid = login("th2", "p")
+        conns = []
+
+        def reader():
+            conns.append(get_conn())
+            list_categories(uid)
+
+        workers = [threading.Thread(target=reader) for _ in range(20)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.assertEqual(len(conns), 20)
+        for conn in conns:
+            with self.assertRaises(sqlite3.ProgrammingError):
+                conn.execute("SELECT 1")
+
+    def test_login_cache_concurrent(self):
+        register("conc", "p")
+        errors = []
+
+        def churn(n):
+            try:
+                for i in range(200):
+                    # distinct keys force evictions while others hit "conc"
+                    app._remember_login(f"u{n}-{i}", "p", i, b"h")
+                    self.assertIsNotNone(login("conc", "p"))
+            except Exception as exc:
+                errors.append(exc)
+
+        workers = [threading.Thread(target=churn, args=(n,)) for n in range(4)]
+        with redirect_stdout(io.StringIO()):
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+        self.assertEqual(errors, [])
+
     def test_backup_restore(self):
         register("buser", "p")
         uid = login("buser", "p")